@@ -2,9 +2,10 @@
 API router for property amenity detection system.
 Defines the endpoints and handlers for the FastAPI service.
 """
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Query
 from pydantic import BaseModel
-import io
+from typing import List, Optional
+import asyncio
 import logging
 import time
 import uuid
@@ -52,17 +53,20 @@ async def detect_amenities(
         raise HTTPException(status_code=400, detail="File must be an image")
     
     try:
-        # Read the image file
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        # Decode straight from the spooled upload instead of copying it into memory first
+        image = Image.open(file.file)
+        image.load()
         
         # Generate a unique ID for this image
         image_id = str(uuid.uuid4())
         image_name = f"{image_id}_{file.filename}"
         
-        # Process image
+        # Process image in the default executor so the event loop keeps accepting uploads
         start_time = time.time()
-        amenities, description = amenity_system.process_image_from_memory(image, image_name)
+        loop = asyncio.get_running_loop()
+        amenities, description, _ = await loop.run_in_executor(
+            None, amenity_system.process_image_from_memory, image, image_name
+        )
         processing_time = time.time() - start_time
         
         # Return results
@@ -78,22 +82,31 @@ async def detect_amenities(
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 @router.get("/results")
-def get_results(amenity_system = Depends(get_amenity_system)):
+def get_results(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    columns: Optional[List[str]] = Query(None),
+    amenity_system = Depends(get_amenity_system)
+):
     """
-    Get summary of all processed results.
+    Get a page of processed results.
     
     Args:
+        limit: Maximum number of images to return
+        offset: Number of images to skip
+        columns: Amenities to include per image, all amenities if omitted
         amenity_system: The PropertyAmenitySystem instance (injected)
         
     Returns:
-        A JSON response with summary of all processed images
+        A JSON response with one page of processed images
     """
     try:
-        # Get results as dictionary (convert dataframe to dict)
-        results = amenity_system.get_all_results()
-        results_dict = results.to_dict(orient="records")
-        return {"results": results_dict}
-    
+        results = list(amenity_system.data_manager.page_results(limit, offset, columns))
+        return {"results": results, "limit": limit, "offset": offset}
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     except Exception as e:
         logger.error(f"Error getting results: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting results: {str(e)}")
@@ -4,8 +4,9 @@ Exposes endpoints to detect amenities from images and generate descriptions.
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
-import hydra
 
 # Configure logging
 logging.basicConfig(
@@ -18,6 +19,9 @@ logger = logging.getLogger(__name__)
 # to avoid configuration issues
 property_amenity_system = None
 
+# Default executor of the event loop, kept so shutdown can wait for running inferences
+inference_executor = None
+
 app = FastAPI(
     title="Property Amenity Detection API",
     description="API for detecting amenities in property images and generating descriptions",
@@ -36,9 +40,10 @@ app.add_middleware(
 @app.on_event("startup")
 def startup_event():
     """Initialize the PropertyAmenitySystem when the API starts."""
-    global property_amenity_system
+    global property_amenity_system, inference_executor
     
     # Initialize Hydra with default config
+    import hydra
     config = hydra.compose(config_name="config", return_hydra_config=True)
     
     # Import here to avoid circular imports
@@ -48,6 +53,24 @@ def startup_event():
     property_amenity_system = PropertyAmenitySystem(config, logger=logger)
     logger.info("PropertyAmenitySystem initialized for API service")
 
+    # Bound the threads that run inference off the event loop
+    max_workers = config.api.inference_workers if hasattr(config, 'api') else 1
+    inference_executor = ThreadPoolExecutor(max_workers=max_workers)
+    asyncio.get_event_loop().set_default_executor(inference_executor)
+    logger.info(f"Inference executor started with {max_workers} worker(s)")
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Flush the write-ahead log and release the shared database connection when the API stops."""
+    # Let running inferences finish saving their results before the connection goes away
+    if inference_executor is not None:
+        inference_executor.shutdown(wait=True)
+        logger.info("Inference executor shut down")
+
+    if property_amenity_system is not None:
+        property_amenity_system.data_manager.close()
+        logger.info("PropertyAmenitySystem data manager closed")
+
 @app.get("/")
 def read_root():
     """Root endpoint to check if API is running."""
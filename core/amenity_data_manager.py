@@ -1,14 +1,41 @@
 """Python file/module that handles the amenity data including storing and retrieval."""
+from __future__ import annotations
+
 import sqlite3
+import math
 import os
 import csv
+import json
 import logging
-import pandas as pd
+import threading
+import numpy as np
 
 from pathlib import Path
 from typing import Dict
 from datetime import datetime
-from typing import List
+from typing import List, Any, Iterable, Iterator, Optional, TYPE_CHECKING
+
+from core.amenity_schema import get_all_amenities
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Statement on the write path, kept as a constant so it is compiled once and then
+# served from the connection's statement cache
+_SQL_UPSERT_IMAGE = (
+    "INSERT INTO images (image_path, description, processed_at, amenity_bits) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(image_path) DO UPDATE SET "
+    "description = excluded.description, processed_at = excluded.processed_at, "
+    "amenity_bits = excluded.amenity_bits "
+    "RETURNING id"
+)
+
+# Number of saved images between explicit WAL checkpoints
+_CHECKPOINT_INTERVAL = 500
+
+def _popcount(bits: Optional[bytes]) -> int:
+    """Count the amenities set in an amenity bitset, registered as an SQL function."""
+    return bin(int.from_bytes(bits, "little")).count("1") if bits else 0
 
 class AmenityDataManager:
     """
@@ -34,45 +61,178 @@ class AmenityDataManager:
             for amenity in amenities:
                 self.all_amenities.append(f"{room_type}_{amenity}")
 
+        # The CSV columns are fixed by the schema, so rows can be appended without
+        # re-reading the file to look for new columns
+        self.csv_amenities = get_all_amenities(amenity_schema)
+        self.fieldnames = ["image_name", "image_path", "description"] + self.csv_amenities
+        self._amenity_index = {amenity: i for i, amenity in enumerate(self.csv_amenities)}
+
         # Initialize CSV file
         self.csv_path = self.output_dir / "amenities.csv"
-        
+        self._initialize_csv()
+
         # Initialize SQLite database
+        # A single connection is shared across calls (and threads, guarded by the lock)
+        # so the page cache and pragmas survive between requests
         self.db_path = self.output_dir / "amenities.db"
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        self._conn.create_function("popcount", 1, _popcount, deterministic=True)
+        self._saves_since_checkpoint = 0
         self._initialize_db()
 
         self.logger.info(f"Data storage initialized at {output_dir}")
 
     def _initialize_db(self):
         """Initialize the SQLite database with appropriate schema."""
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
-        
-        # Create images table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_path TEXT UNIQUE,
-            description TEXT,
-            processed_at TIMESTAMP
-        )
-        ''')
-        
-        # Create amenities table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS amenities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_id INTEGER,
-            room_type TEXT,
-            amenity_name TEXT,
-            is_present BOOLEAN,
-            FOREIGN KEY (image_id) REFERENCES images (id),
-            UNIQUE(image_id, room_type, amenity_name)
-        )
-        ''')
+        with self._lock:
+            cursor = self._conn.cursor()
+
+            # WAL lets readers and the writer run concurrently and cuts fsyncs per commit.
+            # It persists in the database file, so it only needs to be set once here.
+            if str(self.db_path) != ":memory:":
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA cache_size=-20000")
+
+            # Create images table
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_path TEXT UNIQUE,
+                description TEXT,
+                processed_at TIMESTAMP
+            )
+            ''')
         
-        conn.commit()
-        conn.close()
+            # Create amenities table (legacy per-amenity rows, only read when migrating)
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS amenities (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_id INTEGER,
+                room_type TEXT,
+                amenity_name TEXT,
+                is_present BOOLEAN,
+                FOREIGN KEY (image_id) REFERENCES images (id),
+                UNIQUE(image_id, room_type, amenity_name)
+            )
+            ''')
+
+            # Present amenities are stored per image as a bitset indexed like the CSV columns,
+            # instead of one amenities row per (room, amenity) pair. Older databases are
+            # converted once from the amenities table, which is no longer written to.
+            self._migrate_amenity_bits(cursor)
+
+            # Bit positions follow the schema order, which is stored so the bitsets can be
+            # re-encoded when the schema changes instead of decoding to the wrong amenities
+            cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._sync_amenity_order(cursor)
+
+    def _migrate_amenity_bits(self, cursor: sqlite3.Cursor) -> None:
+        """Add the amenity_bits column and fill it from the legacy amenities table, if not done yet."""
+        # The column check, ALTER and backfill run as one transaction under the write lock, so
+        # concurrent opens migrate only once and an interrupted migration is rolled back
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in cursor.execute("PRAGMA table_info(images)")}
+            if "amenity_bits" not in columns:
+                cursor.execute("ALTER TABLE images ADD COLUMN amenity_bits BLOB")
+                present = {}
+                for image_id, amenity_name in cursor.execute(
+                    "SELECT DISTINCT image_id, amenity_name FROM amenities WHERE is_present = 1"
+                ).fetchall():
+                    present.setdefault(image_id, []).append(amenity_name)
+                cursor.executemany(
+                    "UPDATE images SET amenity_bits = ? WHERE id = ?",
+                    [(self._encode_amenities(names), image_id) for image_id, names in present.items()]
+                )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def _sync_amenity_order(self, cursor: sqlite3.Cursor) -> None:
+        """Re-encode stored bitsets if they were written with a different amenity order."""
+        # The order is read under the write lock, so a process opening the database at the same
+        # time cannot re-encode bitsets this one has already re-encoded
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            row = cursor.execute("SELECT value FROM meta WHERE key = 'amenity_order'").fetchone()
+            if row is not None and json.loads(row[0]) == self.csv_amenities:
+                cursor.execute("COMMIT")
+                return
+
+            if row is not None:
+                stored_order = json.loads(row[0])
+                self.logger.info(f"Re-encoding stored amenities in {self.db_path} for the current amenity schema")
+                images = cursor.execute(
+                    "SELECT id, amenity_bits FROM images WHERE amenity_bits IS NOT NULL"
+                ).fetchall()
+                cursor.executemany(
+                    "UPDATE images SET amenity_bits = ? WHERE id = ?",
+                    [
+                        (self._encode_amenities(self._decode_amenities(bits, stored_order)), image_id)
+                        for image_id, bits in images
+                    ]
+                )
+            # Databases without a stored order were written with the current schema
+            cursor.execute(
+                "INSERT INTO meta (key, value) VALUES ('amenity_order', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (json.dumps(self.csv_amenities),)
+            )
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _decode_amenities(bits: Optional[bytes], amenity_order: List[str]) -> List[str]:
+        """Unpack an amenity bitset into the names of the amenities it marks as present."""
+        value = int.from_bytes(bits or b"", "little")
+        return [amenity for index, amenity in enumerate(amenity_order) if (value >> index) & 1]
+
+    def _encode_amenities(self, present_amenities: Iterable[str]) -> bytes:
+        """Pack the given amenity names into a bitset, one bit per schema amenity."""
+        bits = bytearray(math.ceil(len(self.csv_amenities) / 8))
+        for amenity_name in present_amenities:
+            index = self._amenity_index.get(amenity_name)
+            if index is not None:
+                bits[index >> 3] |= 1 << (index & 7)
+        return bytes(bits)
+
+    def _initialize_csv(self):
+        """Write the CSV header, migrating an existing file once if its columns differ."""
+        if not os.path.exists(self.csv_path) or os.path.getsize(self.csv_path) == 0:
+            with open(self.csv_path, 'w', newline='') as csvfile:
+                csv.writer(csvfile).writerow(self.fieldnames)
+            return
+
+        with open(self.csv_path, 'r', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            if reader.fieldnames == self.fieldnames:
+                return
+            existing_rows = list(reader)
+
+        # Rewrite the CSV with the schema columns, filling missing amenities with 0
+        self.logger.info(f"Migrating {self.csv_path} to the current amenity schema columns")
+        with open(self.csv_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=self.fieldnames, restval=0, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(existing_rows)
+
+    def close(self) -> None:
+        """Checkpoint the write-ahead log into the database and close the shared SQLite connection."""
+        with self._lock:
+            try:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                # A failed checkpoint (e.g. a locked database) must not leave the connection open
+                self._conn.close()
 
     def save_results(self, 
                     image_path: str, 
@@ -106,30 +266,27 @@ class AmenityDataManager:
         description: str
     ) -> None:
         """Save results to SQLite database."""
-        conn = sqlite3.connect(str(self.db_path))
-        cursor = conn.cursor()
-        
-        # Insert or update image record
-        # ? indicates the placeholder for the values to be inserted
-        cursor.execute(
-            "INSERT OR REPLACE INTO images (image_path, description, processed_at) VALUES (?, ?, ?)",
-            (image_path, description, datetime.now().isoformat())
+        # An amenity listed under several rooms is stored once
+        amenity_bits = self._encode_amenities(
+            amenity_name
+            for room_amenities in amenities.values()
+            for amenity_name, is_present in room_amenities.items()
+            if is_present
         )
 
-        # Get the image_id (either newly inserted or existing)
-        cursor.execute("SELECT id FROM images WHERE image_path = ?", (image_path,))
-        image_id = cursor.fetchone()[0]
-        
-        # Insert amenity records
-        for room_type, room_amenities in amenities.items():
-            for amenity_name, is_present in room_amenities.items():
-                cursor.execute(
-                    "INSERT OR REPLACE INTO amenities (image_id, room_type, amenity_name, is_present) VALUES (?, ?, ?, ?)",
-                    (image_id, room_type, amenity_name, is_present)
-                )
-        
-        conn.commit()
-        conn.close()
+        with self._lock:
+            # Insert or update image record in place, keeping its id stable
+            # ? indicates the placeholder for the values to be inserted
+            self._conn.execute(
+                _SQL_UPSERT_IMAGE,
+                (image_path, description, datetime.now().isoformat(), amenity_bits)
+            ).fetchone()
+
+            # Bound the WAL file size on long runs, the automatic checkpoint can be starved by readers
+            self._saves_since_checkpoint += 1
+            if self._saves_since_checkpoint >= _CHECKPOINT_INTERVAL:
+                self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                self._saves_since_checkpoint = 0
 
     def _save_to_csv(
         self,
@@ -139,67 +296,18 @@ class AmenityDataManager:
         description: str
     ) -> None:
         """Save results to CSV file."""
-        # Flatten the amenities dictionary for CSV storage
-        flat_data = {
-            "image_name": image_name,
-            "image_path": image_path,
-            "description": description
-        }
-
-        # Add all detected amenities
+        # Amenities missing from the detection are stored as 0, unknown ones are dropped
+        values = np.zeros(len(self.csv_amenities), dtype=np.uint8)
         for amenity_name, is_present in detected_amenities.items():
-            flat_data[amenity_name] = int(is_present)
-
-        # Check if file exists to determine if we need to write header
-        file_exists = os.path.exists(self.csv_path) and os.path.getsize(self.csv_path) > 0
-
-        # Get current data field names
-        current_fields = list(flat_data.keys())
-
-        if file_exists:
-            with open(self.csv_path, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                existing_rows = list(reader)
-                existing_fieldnames = reader.fieldnames if reader.fieldnames else []
-
-            # Detect new columns if any
-            new_columns = [field for field in current_fields if field not in existing_fieldnames]
-
-            if new_columns:
-                # Add new columns to existing fieldnames
-                updated_fieldnames = existing_fieldnames + new_columns
-
-                # Rewrite the CSV with updated headers and existing data
-                with open(self.csv_path, 'w', newline='') as csvfile:
-                    writer = csv.DictWriter(csvfile, fieldnames=updated_fieldnames)
-                    writer.writeheader()
-                    for row in existing_rows:
-                        # Fill the missing columns with 0
-                        for col in new_columns:
-                            row[col] = 0
-                        writer.writerow(row)
-                
-                fieldnames = updated_fieldnames
-            else:
-                fieldnames = existing_fieldnames
+            index = self._amenity_index.get(amenity_name)
+            if index is not None:
+                values[index] = bool(is_present)
 
-        else:
-            # First write: use amenity schema to get all possible amenities
-            all_amenities = sorted({a for amenities in self.amenity_schema.values() for a in amenities})
-            fieldnames = ["image_name", "image_path", "description"] + all_amenities
-
-        # Ensure all amenity columns are included in the data, even if not in current image
-        for field in fieldnames:
-            if field not in flat_data:
-                flat_data[field] = 0
-
-        # Write to CSV
-        mode = 'a' if file_exists else 'w'
-        with open(self.csv_path, mode, newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(flat_data)
+        row = (image_name, image_path, description, *values.tolist())
+
+        # Rows may come from several worker threads, keep each append whole
+        with self._lock, open(self.csv_path, 'a', newline='') as csvfile:
+            csv.writer(csvfile).writerow(row)
 
     def get_results_summary(self) -> pd.DataFrame:
         """
@@ -208,21 +316,18 @@ class AmenityDataManager:
         Returns:
             DataFrame containing image paths and amenity counts
         """
+        import pandas as pd
+
         try:
-            conn = sqlite3.connect(str(self.db_path))
-            
             # Query to get image paths and amenity counts
             query = """
-            SELECT i.image_path, i.description, 
-                   SUM(CASE WHEN a.is_present = 1 THEN 1 ELSE 0 END) as amenity_count
-            FROM images i
-            LEFT JOIN amenities a ON i.id = a.image_id
-            GROUP BY i.image_path, i.description
+            SELECT image_path, description, popcount(amenity_bits) AS amenity_count
+            FROM images
             ORDER BY amenity_count DESC
             """
 
-            df = pd.read_sql_query(query, conn)
-            conn.close()
+            with self._lock:
+                df = pd.read_sql_query(query, self._conn)
             return df
 
         except Exception as e:
@@ -230,6 +335,47 @@ class AmenityDataManager:
                 self.logger.error(f"Error retrieving results summary: {e}")
             return pd.DataFrame(columns=["image_name", "image_path", "description", "amenity_count"])
 
+    def page_results(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        columns: Optional[List[str]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over one page of results from the database.
+
+        Args:
+            limit: Maximum number of images to return, negative for no limit
+            offset: Number of images to skip, in processing order
+            columns: Amenities to include in each row, defaults to all amenities in the schema
+
+        Returns:
+            Iterator of dictionaries, one per image, with each requested amenity as a 0/1 value
+        """
+        if columns is None:
+            columns = self.csv_amenities
+        else:
+            unknown = [column for column in columns if column not in self._amenity_index]
+            if unknown:
+                raise ValueError(f"Unknown amenity columns: {', '.join(unknown)}")
+
+        with self._lock:
+            images = self._conn.execute(
+                "SELECT image_path, description, amenity_bits FROM images ORDER BY id LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+
+        indices = [(column, self._amenity_index[column]) for column in columns]
+        for image_path, description, amenity_bits in images:
+            bits = int.from_bytes(amenity_bits or b"", "little")
+            row = {
+                "image_name": os.path.basename(image_path),
+                "image_path": image_path,
+                "description": description,
+            }
+            row.update((column, (bits >> index) & 1) for column, index in indices)
+            yield row
+
     def get_all_results_as_dataframe(self) -> pd.DataFrame:
         """
         Get all results as a single dataframe with each amenity as a column.
@@ -237,6 +383,8 @@ class AmenityDataManager:
         Returns:
             DataFrame with each image as a row and each amenity as a column
         """
+        import pandas as pd
+
         try:
             # Read the CSV file directly as it's already in the desired format
             df = pd.read_csv(self.csv_path)
@@ -246,41 +394,8 @@ class AmenityDataManager:
             
             # As a fallback, reconstruct from SQLite
             try:
-                conn = sqlite3.connect(str(self.db_path))
-                
-                # Get all images
-                images_df = pd.read_sql_query("SELECT id, image_path, description FROM images", conn)
-                
-                # Get all amenities
-                amenities_df = pd.read_sql_query(
-                    "SELECT image_id, room_type, amenity_name, is_present FROM amenities", 
-                    conn
-                )
-                
-                # Create pivot table of amenities
-                if not amenities_df.empty:
-                    pivot_df = amenities_df.pivot_table(
-                        index='image_id', 
-                        columns=['room_type', 'amenity_name'], 
-                        values='is_present',
-                        fill_value=0
-                    )
-                    
-                    # Flatten column names
-                    pivot_df.columns = [f"{room}_{amenity}" for room, amenity in pivot_df.columns]
-                    
-                    # Reset index to merge with images_df
-                    pivot_df = pivot_df.reset_index()
-                    
-                    # Merge with images data
-                    result_df = pd.merge(images_df, pivot_df, left_on='id', right_on='image_id')
-                    result_df = result_df.drop(columns=['id', 'image_id'])
-                else:
-                    result_df = images_df.drop(columns=['id'])
-                
-                conn.close()
-                return result_df
-                
+                return pd.DataFrame.from_records(self.page_results(limit=-1), columns=self.fieldnames)
+
             except Exception as inner_e:
                 self.logger.error(f"Error reconstructing data from SQLite: {inner_e}")
                 return pd.DataFrame()
@@ -1,9 +1,11 @@
 """Python file/module for the detecting amenities in an image/property."""
 import logging
+import threading
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 from PIL import Image
 from model.llava import LlavaModel
+from core.amenity_schema import get_all_amenities
 
 def get_model_instance(model_name):
     """
@@ -32,7 +34,14 @@ class AmenityDetector:
     """
     Detects amenities in property images using a vision-language model.
     """
-    def __init__(self, model_name: str, amenity_schema: Dict[str, List[str]], logger=None, save_dir: str = None):
+    def __init__(
+        self,
+        model_name: str,
+        amenity_schema: Dict[str, List[str]],
+        logger=None,
+        save_dir: str = None,
+        compile_model: bool = False
+    ):
         """
         Initialize the amenity detector with a specified model and schema.
         
@@ -41,19 +50,36 @@ class AmenityDetector:
             amenity_schema: Dictionary mapping room types to lists of amenities
             logger: Optional logger instance
             save_dir: Directory to save model weights
+            compile_model: Whether to compile the model forward pass with torch.compile
         """
         self.logger = logger or logging.getLogger(__name__)
         self.logger.info(f"Initializing AmenityDetector with model: {model_name}")
         
-        self.model = LlavaModel(model_name, logger=logger, save_folder=save_dir)
+        self.model = LlavaModel(model_name, logger=logger, save_folder=save_dir, compile_model=compile_model)
         self.amenity_schema = amenity_schema
+
+        # The schema is fixed for the lifetime of the detector, so flatten it only once
+        self._all_amenities = get_all_amenities(amenity_schema)
+        self._room_items = tuple((room_type, tuple(amenities)) for room_type, amenities in amenity_schema.items())
+
+        # The processor resizes images down to this anyway, so JPEGs can be decoded at a reduced scale
+        image_size = self.model.processor.image_processor.size.get("shortest_edge", 336)
+        self._draft_size = (image_size, image_size)
+
+        # One model and processor are shared by every caller thread. Generation is GPU bound, and the
+        # fast tokenizer's padding state cannot be switched concurrently, so model calls are serialized
+        # while image loading and result storage still run in parallel.
+        self._model_lock = threading.Lock()
         
-    def detect_amenities(self, image_path: str) -> Tuple[Dict[str, Dict[str, bool]], str, Dict[str, List[str]]]:
+    def detect_amenities(
+        self,
+        image_path: Union[str, Image.Image]
+    ) -> Tuple[Dict[str, Dict[str, bool]], str, Dict[str, List[str]]]:
         """
         Detect amenities in an image and generate a description.
         
         Args:
-            image_path: Path to the image file
+            image_path: Path to the image file, or an already loaded PIL Image
             
         Returns:
             Tuple of (amenities_by_room, description, detected_amenities)
@@ -61,39 +87,79 @@ class AmenityDetector:
             - description: Generated natural language description
             - detected_amenities: Flat dictionary of amenities and their presence status
         """
-        self.logger.info(f"Processing image: {image_path}")
-        
-        # Load image
+        image = self._load_image(image_path)
+        if image is None:
+            return {}, "Error processing image", {}
+            
+        # Detect amenities
+        with self._model_lock:
+            detected_amenities = self.model.detect_amenities(image, self._all_amenities)
+
+        return self._build_results(image, detected_amenities)
+
+    def detect_amenities_batch(
+        self,
+        image_paths: List[Union[str, Image.Image]]
+    ) -> List[Tuple[Dict[str, Dict[str, bool]], str, Dict[str, List[str]]]]:
+        """
+        Detect amenities in several images with one model pass and generate their descriptions.
+
+        Args:
+            image_paths: Paths to the image files, or already loaded PIL Images
+
+        Returns:
+            List of (amenities_by_room, description, detected_amenities) tuples, in the order of image_paths
+        """
+        images = [self._load_image(image_path) for image_path in image_paths]
+        loaded = [image for image in images if image is not None]
+
+        # Detect amenities for all images that could be loaded in a single batch
+        with self._model_lock:
+            detections = iter(self.model.detect_amenities_batch(loaded, self._all_amenities) if loaded else [])
+
+        return [
+            self._build_results(image, next(detections)) if image is not None else ({}, "Error processing image", {})
+            for image in images
+        ]
+
+    def _load_image(self, image_path: Union[str, Image.Image]) -> Optional[Image.Image]:
+        """
+        Load an image as RGB, unless it has already been decoded by the caller.
+
+        Args:
+            image_path: Path to the image file, or an already loaded PIL Image
+
+        Returns:
+            The RGB image, or None if it could not be loaded
+        """
         try:
-            image = Image.open(image_path).convert("RGB")
+            if isinstance(image_path, Image.Image):
+                self.logger.info("Processing in-memory image")
+                return image_path.convert("RGB")
+
+            self.logger.info(f"Processing image: {image_path}")
+            with open(image_path, "rb", buffering=1 << 20) as f:
+                image = Image.open(f)
+                image.draft("RGB", self._draft_size)
+                return image.convert("RGB")
         except Exception as e:
             self.logger.error(f"Error loading image {image_path}: {e}")
-            return {}, "Error processing image", {}
-            
-        # Create a flattened list of all amenities for detection
-        all_amenities = []
-        for amenities in self.amenity_schema.values():
-            all_amenities.extend(amenities)
+            return None
 
-        # Remove duplicates
-        all_amenities = sorted(list(set(all_amenities)))
-        
-        # Detect amenities
-        detected_amenities = self.model.detect_amenities(image, all_amenities)
-        
+    def _build_results(
+        self,
+        image: Image.Image,
+        detected_amenities: Dict[str, bool]
+    ) -> Tuple[Dict[str, Dict[str, bool]], str, Dict[str, List[str]]]:
+        """Restructure detected amenities by room and generate the description."""
         # Restructure into room-based schema
-        amenities_by_room = {room_type: {} for room_type in self.amenity_schema}
-        present_amenities_by_room = {room_type: [] for room_type in self.amenity_schema}
-        
-        # Instead of returning present_amenities_by_room, lets return detected_amenities to keep it simple
-        for room_type, amenities in self.amenity_schema.items():
-            for amenity in amenities:
-                is_present = detected_amenities.get(amenity, False)
-                amenities_by_room[room_type][amenity] = is_present
-                if is_present:
-                    present_amenities_by_room[room_type].append(amenity)
+        amenities_by_room = {
+            room_type: {amenity: detected_amenities.get(amenity, False) for amenity in amenities}
+            for room_type, amenities in self._room_items
+        }
         
         # Generate description
-        description = self.model.generate_description(img=image, detected_amenities=detected_amenities)
+        with self._model_lock:
+            description = self.model.generate_description(img=image, detected_amenities=detected_amenities)
         
         return amenities_by_room, description, detected_amenities
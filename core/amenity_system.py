@@ -1,9 +1,10 @@
 """Python file that has the system that handles the detection, storage and generation."""
+from __future__ import annotations
+
 import json
-import pandas as pd
 import logging
-from omegaconf import DictConfig
-from typing import Tuple, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Dict, List, TYPE_CHECKING
 from pathlib import Path
 from PIL import Image
 
@@ -11,6 +12,10 @@ from core.amenity_schema import load_amenity_schema
 from core.amenity_detector import AmenityDetector
 from core.amenity_data_manager import AmenityDataManager
 
+if TYPE_CHECKING:
+    import pandas as pd
+    from omegaconf import DictConfig
+
 class PropertyAmenitySystem:
     """
     Main system that orchestrates the detection, storage, and description generation.
@@ -37,7 +42,8 @@ class PropertyAmenitySystem:
             model_name=config.model.name,
             amenity_schema=self.amenity_schema,
             logger=self.logger,
-            save_dir=config.output.model_weight_dir if hasattr(config.output, 'model_weight_dir') else None
+            save_dir=config.output.model_weight_dir if hasattr(config.output, 'model_weight_dir') else None,
+            compile_model=config.model.compile if hasattr(config.model, 'compile') else False
         )
 
         self.data_manager = AmenityDataManager(
@@ -89,23 +95,42 @@ class PropertyAmenitySystem:
         
         if not image_paths:
             self.logger.warning(f"No images found in {directory_path}")
+            import pandas as pd
             return pd.DataFrame()
         
         self.logger.info(f"Found {len(image_paths)} images to process")
         
-        # Process each image
-        for img_path in image_paths:
+        # Group images into batches that share one model pass
+        batch_size = self.config.inference.batch_size if hasattr(self.config, 'inference') else 1
+        batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+
+        # Process batches concurrently so decoding and storage overlap with model inference,
+        # the detector runs one model call at a time
+        num_workers = self.config.inference.num_workers if hasattr(self.config, 'inference') else 1
+        max_workers = min(num_workers, len(batches))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self._process_batch_and_log, batches))
+
+        # Return summary
+        return self.data_manager.get_results_summary()
+
+    def _process_batch_and_log(self, img_paths: List[Path]) -> None:
+        """Process a batch of images from a directory run, logging instead of raising errors."""
+        try:
+            results = self.detector.detect_amenities_batch([str(img_path) for img_path in img_paths])
+        except Exception as e:
+            self.logger.error(f"Error processing batch {[str(img_path) for img_path in img_paths]}: {e}")
+            return
+
+        for img_path, (amenities_by_room, description, detected_amenities) in zip(img_paths, results):
             try:
-                amenities_by_room, description, detected_amenities = self.process_image(str(img_path))
+                self.data_manager.save_results(str(img_path), amenities_by_room, description, detected_amenities)
                 self.logger.info(f"Processed {img_path}")
                 self.logger.info(f"Detected ameneties: {detected_amenities}")
                 self.logger.info(f"Description: {description}")
             except Exception as e:
                 self.logger.error(f"Error processing {img_path}: {e}")
 
-        # Return summary
-        return self.data_manager.get_results_summary()
-
     def process_image_from_memory(self, image: Image.Image, image_name: str) -> Tuple[Dict[str, Dict[str, bool]], str]:
         """
         Process an image that's already loaded into memory.
@@ -118,20 +143,14 @@ class PropertyAmenitySystem:
             Tuple of (amenities, description)
         """
         self.logger.info(f"Processing in-memory image: {image_name}")
-        
-        # Save the image temporarily to process it
-        temp_dir = Path(self.config.output.directory) / "temp"
-        temp_dir.mkdir(exist_ok=True, parents=True)
-        temp_path = temp_dir / image_name
-        
-        try:
-            image.save(temp_path)
-            amenities_by_room, description, detected_amenities = self.process_image(str(temp_path))
-            return amenities_by_room, description, detected_amenities
-        finally:
-            # Clean up the temporary file
-            if temp_path.exists():
-                temp_path.unlink()
+
+        # Hand the decoded image straight to the detector; the name stands in for the path
+        amenities_by_room, description, detected_amenities = self.detector.detect_amenities(image)
+
+        # Save results
+        self.data_manager.save_results(image_name, amenities_by_room, description, detected_amenities)
+
+        return amenities_by_room, description, detected_amenities
     
     def get_all_results(self) -> pd.DataFrame:
         """
@@ -1,5 +1,5 @@
 """Imports for dataloaders."""
 
-from .sunrgb_d import SUNRGBDDataset
+from .sunrgb_d import SUNRGBDDataset, build_dataloader, decode_images_gpu
 
-__all__ = ["SUNRGBDDataset"]
\ No newline at end of file
+__all__ = ["SUNRGBDDataset", "build_dataloader", "decode_images_gpu"]
\ No newline at end of file
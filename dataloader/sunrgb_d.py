@@ -3,62 +3,87 @@ import os
 import numpy as np
 import torch
 import json
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
-from torch.utils.data import Dataset
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Dataset, DataLoader
 from PIL import Image
-from utilities.general_utils import load_json, save_plot
+from utilities.general_utils import load_json, get_plot_path, save_plot
 
 
 class SUNRGBDDataset(Dataset):
-    def __init__(self, root_dir, debug=False):
+    def __init__(self, root_dir, debug=False, decode_on_gpu=False):
         """
         Args:
             root_dir (str): Root directory of the SUN RGB-D dataset.
+            decode_on_gpu (bool): Return JPEGs as encoded bytes, to be decoded in batches on the GPU
+                with decode_images_gpu. Ignored when CUDA is not available.
         """
         self.root_dir = root_dir
         self.debug = debug
-        self.data = self._load_data()
+        self.decode_on_gpu = decode_on_gpu and torch.cuda.is_available()
+        self._load_data()
 
     def _load_data(self):
         """
         Recursively loads the dataset and stores relevant information.
 
+        The index is kept as parallel fixed-width string arrays (folder names, image paths, annotation
+        paths and scene labels) rather than a list of dicts. Their buffers hold no Python object
+        references, so DataLoader workers can share them copy-on-write after forking.
+        """
+        # scandir gives the entry type from the directory listing itself, saving a stat per folder
+        with os.scandir(self.root_dir) as folders:
+            folders = [folder for folder in folders if folder.is_dir()]
+
+        # Probing is pure filesystem metadata I/O, so overlap it across threads.
+        # map keeps the listing order, making the result identical to a sequential scan.
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            dataset = [item for item in executor.map(self._probe_folder, folders) if item is not None]
+
+        folder_names, image_paths, annotation_paths, scenes = zip(*dataset) if dataset else ((), (), (), ())
+        self.folder_names = np.array(folder_names, dtype=str)
+        self.image_paths = np.array(image_paths, dtype=str)
+        self.annotation_paths = np.array(annotation_paths, dtype=str)
+        self.scenes = np.array(scenes, dtype=str)
+
+    def _probe_folder(self, folder):
+        """
+        Checks a single dataset folder for an image, its annotations and the scene label.
+
+        Args:
+            folder (os.DirEntry): Directory entry of the data folder.
         Returns:
-            list: A list of dictionaries containing folder name, image path, annotation path, and scene.txt path.
-        """
-        dataset = []
-        count = 0
-        for data_folder in os.listdir(self.root_dir):
-            data_folder_path = os.path.join(self.root_dir, data_folder)
-            if not os.path.isdir(data_folder_path):
-                continue
-
-            image_dir = os.path.join(data_folder_path, "image")
-            annotation_dir = os.path.join(data_folder_path, "annotation2Dfinal")
-            scene_path = os.path.join(data_folder_path, "scene.txt")
-
-            if os.path.exists(image_dir) and os.path.exists(annotation_dir) and os.path.exists(scene_path):
-                image_files = [f for f in os.listdir(image_dir) if f.endswith(('.jpg', '.png'))]
-                if not image_files:
-                    continue
-                image_path = os.path.join(image_dir, image_files[0])
-                annotation_path = os.path.join(annotation_dir, "index.json")
-
-                if os.path.exists(image_path) and os.path.exists(annotation_path):
-                    dataset.append({
-                        "folder_name": data_folder,
-                        "image_path": image_path,
-                        "annotation_path": annotation_path,
-                        "scene_path": scene_path.strip()
-                    })
-                    count += 1
-
-        return dataset
+            tuple: Folder name, image path, annotation path and scene label, or None if anything is missing.
+        """
+        image_dir = os.path.join(folder.path, "image")
+        annotation_path = os.path.join(folder.path, "annotation2Dfinal", "index.json")
+        scene_path = os.path.join(folder.path, "scene.txt")
+
+        if not os.path.isfile(annotation_path):
+            return None
+
+        # The first image found in the listing already proves it exists
+        try:
+            with os.scandir(image_dir) as images:
+                image_path = next(
+                    (image.path for image in images if image.name.endswith(('.jpg', '.png'))), None
+                )
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if image_path is None:
+            return None
+
+        # scene.txt is a few bytes, read it once here instead of on every sample access
+        try:
+            with open(scene_path, 'r') as f:
+                scene = f.read().strip()
+        except FileNotFoundError:
+            return None
+
+        return folder.name, image_path, annotation_path, scene
 
     def __len__(self):
-        return len(self.data)
+        return len(self.image_paths)
 
     def __getitem__(self, idx):
         """
@@ -70,17 +95,15 @@ class SUNRGBDDataset(Dataset):
         if torch.is_tensor(idx):
             idx = idx.tolist()
 
-        item = self.data[idx]
-        image = self._load_image(item["image_path"])
-        annotations = load_json(item["annotation_path"])
-        with open(item["scene_path"], 'r') as f:
-            scene = f.read().strip()
+        image_path = str(self.image_paths[idx])
+        image = self._load_image_encoded(image_path) if self.decode_on_gpu else self._load_image(image_path)
+        annotations = load_json(str(self.annotation_paths[idx]))
 
         return {
-            "folder_name": item["folder_name"],
+            "folder_name": str(self.folder_names[idx]),
             "image": image,
             "annotations": annotations,
-            "scene": scene
+            "scene": str(self.scenes[idx])
         }
 
     def _load_image(self, image_path):
@@ -97,33 +120,61 @@ class SUNRGBDDataset(Dataset):
             print(f"Error loading image: {e}")
             return None
 
+    def _load_image_encoded(self, image_path):
+        """
+        Reads an image for GPU decoding. JPEGs are returned as their raw file bytes, other formats
+        are decoded on the CPU since nvJPEG only handles JPEG.
+        Args:
+            image_path (str): Path to the image file.
+        Returns:
+            torch.Tensor: 1D uint8 tensor of JPEG bytes, or a CHW uint8 RGB tensor.
+        """
+        from torchvision.io import read_file, decode_image, ImageReadMode
+
+        data = read_file(image_path)
+        if image_path.endswith(".jpg"):
+            return data
+        return decode_image(data, mode=ImageReadMode.RGB)
+
     def get_segments_2d(self, annotations):
         """
         Returns the segments in 2D.
         """
-        segments = []
-        labels = []
-        for polygon in annotations['frames'][0]['polygon']:
-            x = polygon["x"]
-            y = polygon["y"]
-            obj_pointer = polygon["object"]
-            points = np.transpose(np.array([x, y], np.int32))
-            segments.append(points)
-            labels.append(annotations['objects'][obj_pointer]["name"])
+        objects = annotations['objects']
+        polygons = annotations['frames'][0]['polygon']
+
+        # Each segment is an (N, 2) int32 array of x, y points
+        segments = [
+            np.column_stack((np.asarray(polygon["x"], dtype=np.int32), np.asarray(polygon["y"], dtype=np.int32)))
+            for polygon in polygons
+        ]
+        labels = [objects[polygon["object"]]["name"] for polygon in polygons]
         return labels, segments
 
-    def show_annotations(self, idx):
+    def show_annotations(self, idx, interactive=True):
         """
         Displays the image and prints its annotations and class.
         Args:
             idx (int): Index of the data point.
+            interactive (bool): In debug mode, show the annotations in a matplotlib window. Otherwise
+                they are drawn with OpenCV and only saved to disk.
         """
         data = self[idx]
-        image = data["image"]
+        # With decode_on_gpu the sample holds encoded bytes, decode this one on the CPU for drawing
+        image = self._load_image(str(self.image_paths[idx])) if self.decode_on_gpu else data["image"]
         annotations = data["annotations"]
         labels, segments = self.get_segments_2d(annotations)
-        
-        if self.debug:
+
+        if not (self.debug and interactive):
+            self._save_annotations_cv2(np.array(image), labels, segments, data["folder_name"])
+        else:
+            try:
+                import matplotlib.pyplot as plt
+                import matplotlib.patches as patches
+            except ImportError:
+                print("matplotlib is not installed, cannot show annotations")
+                return
+
             image_np = np.array(image)
             fig, ax = plt.subplots(1, figsize=(10, 10))
             ax.imshow(image_np)
@@ -138,6 +189,88 @@ class SUNRGBDDataset(Dataset):
             plt.show()
             save_plot(fig, data["folder_name"])
 
+    def _save_annotations_cv2(self, image_np, labels, segments, folder_name):
+        """
+        Draws the annotation polygons and labels onto the image and saves it, without matplotlib.
+        Args:
+            image_np (np.ndarray): RGB image, drawn on in place.
+            labels (list): Label of each segment.
+            segments (list): (N, 2) int32 arrays of polygon points.
+            folder_name (str): The folder name to use in the file name.
+        """
+        try:
+            import cv2
+        except ImportError:
+            print("opencv-python is not installed, cannot save annotations")
+            return
+
+        # Colours are RGB, the image is converted to BGR only when written
+        cv2.polylines(image_np, segments, isClosed=True, color=(255, 0, 0), thickness=2)
+        for label, segment in zip(labels, segments):
+            x, y = segment[0]
+            cv2.putText(image_np, label, (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1, cv2.LINE_AA)
+
+        output_path = get_plot_path(folder_name)
+        # Fast zlib level, matching save_plot
+        cv2.imwrite(output_path, cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        print(f"Plot saved to {output_path}")
+
+
+def custom_collate(batch):
+    """
+    Collates dataset samples into a dictionary of lists.
+    Images differ in size and annotations are nested dictionaries, so nothing is stacked.
+    Args:
+        batch (list): Samples returned by SUNRGBDDataset.__getitem__.
+    Returns:
+        dict: Keys of the samples, each mapped to the list of values in the batch.
+    """
+    return {key: [sample[key] for sample in batch] for key in batch[0]}
+
+
+def decode_images_gpu(images):
+    """
+    Decodes a batch of images from a decode_on_gpu dataset with one nvJPEG call.
+    Must run in the main process (e.g. on the collated batch), CUDA cannot be used in forked workers.
+    Args:
+        images (list): Tensors returned by SUNRGBDDataset._load_image_encoded.
+    Returns:
+        list: CHW uint8 RGB tensors on the GPU.
+    """
+    from torchvision.io import decode_jpeg, ImageReadMode
+
+    decoded = list(images)
+    encoded = [i for i, image in enumerate(images) if image.ndim == 1]
+    if encoded:
+        jpegs = decode_jpeg([images[i] for i in encoded], mode=ImageReadMode.RGB, device="cuda")
+        for i, image in zip(encoded, jpegs):
+            decoded[i] = image
+    return [image.to("cuda") for image in decoded]
+
+
+def build_dataloader(dataset, batch_size, num_workers=min(8, os.cpu_count() or 1), shuffle=True):
+    """
+    Creates a DataLoader with worker settings suited to the disk and decode bound dataset.
+    Args:
+        dataset (Dataset): The dataset to load from, e.g. SUNRGBDDataset.
+        batch_size (int): Number of samples per batch.
+        num_workers (int): Number of worker processes, 0 to load in the main process.
+        shuffle (bool): Whether to shuffle the samples every epoch.
+    Returns:
+        DataLoader: The configured data loader.
+    """
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        pin_memory=torch.cuda.is_available(),
+        # Keep workers alive between epochs instead of re-forking them
+        persistent_workers=num_workers > 0,
+        prefetch_factor=2 if num_workers > 0 else None,
+        collate_fn=custom_collate,
+    )
+
 
 # To test the dataset
 if __name__ == "__main__":
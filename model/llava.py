@@ -1,12 +1,67 @@
 """Python file that is meant for Llava model."""
 import json
+import importlib.util
 import torch
 import os
 import logging
 
 from PIL import Image
 from typing import List, Dict
-from transformers import LlavaProcessor, LlavaForConditionalGeneration
+from utilities.general_utils import json_loads
+from transformers import (
+    LlavaProcessor,
+    LlavaForConditionalGeneration,
+    BitsAndBytesConfig,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+
+
+def get_attn_implementation() -> str:
+    """
+    Pick the fastest attention kernel available on this machine.
+
+    Returns:
+        "flash_attention_2" if flash-attn is installed and a GPU is present, otherwise "sdpa"
+    """
+    if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+        return "flash_attention_2"
+    return "sdpa"
+
+
+class JSONBraceStop(StoppingCriteria):
+    """
+    Stops generation for each sequence once the first JSON object it opens has been closed.
+    Braces are tracked incrementally from the newest token of every step, so a fresh
+    instance is needed for each generate call.
+    """
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.depth = None
+        self.opened = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        batch_size = input_ids.shape[0]
+        if self.depth is None:
+            self.depth = [0] * batch_size
+            self.opened = [False] * batch_size
+
+        done = []
+        for i, token_text in enumerate(self.tokenizer.batch_decode(input_ids[:, -1:])):
+            if not (self.opened[i] and self.depth[i] == 0):
+                for char in token_text:
+                    if char == "{":
+                        self.depth[i] += 1
+                        self.opened[i] = True
+                    elif char == "}" and self.depth[i] > 0:
+                        self.depth[i] -= 1
+            done.append(self.opened[i] and self.depth[i] == 0)
+
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def is_closed(self, index: int) -> bool:
+        """Whether the sequence at index has opened and closed its JSON object."""
+        return self.opened is not None and self.opened[index] and self.depth[index] == 0
 
 
 class LlavaModel:
@@ -14,14 +69,23 @@ class LlavaModel:
     LlavaModel model class.
     Handles loading the model and performing generation.
     """
-    def __init__(self, model_name: str = 'llava-hf/llava-1.5-7b-hf', logger=None, save_folder=None):
+    def __init__(
+        self,
+        model_name: str = 'llava-hf/llava-1.5-7b-hf',
+        logger=None,
+        save_folder=None,
+        compile_model: bool = False
+    ):
         super().__init__()
         self.processor = None
         self.model = None
         self.config = None
+        self._detect_prompts = {}
         self.logger = logger or logging.getLogger(__name__)
         save_folder = save_folder if save_folder is not None else f"/home/s.bhat/Coding/amenity_detection/model/LlavaModel/{model_name}"
         self._load_model(save_folder=save_folder, model_name=model_name)
+        if compile_model:
+            self._compile_model()
 
     def _load_model(self, save_folder, model_name):
         """
@@ -34,13 +98,23 @@ class LlavaModel:
         processor_path = os.path.join(save_folder, "processor")
         model_path = os.path.join(save_folder, "model")
 
+        # 4-bit NF4 weights with FP16 compute, used for both the online and the local load
+        bnb_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=torch.float16,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_use_double_quant=True,
+        )
+
         if not os.path.exists(processor_path) or not os.path.exists(model_path):
             # Load from online and save locally
             self.processor = LlavaProcessor.from_pretrained(model_name)
             self.model = LlavaForConditionalGeneration.from_pretrained(
             model_name,
-            load_in_4bit=True,
+            quantization_config=bnb_config,
             torch_dtype=torch.float16,
+            device_map="auto",
+            attn_implementation=get_attn_implementation(),
             )
             # Save locally
             self.processor.save_pretrained(processor_path)
@@ -52,15 +126,36 @@ class LlavaModel:
             self.processor = LlavaProcessor.from_pretrained(processor_path)
             self.model = LlavaForConditionalGeneration.from_pretrained(
             model_path,
+            quantization_config=bnb_config,
             torch_dtype=torch.float16,
-            device_map="auto"
+            device_map="auto",
+            attn_implementation=get_attn_implementation(),
             )
             self.logger.info(f"LLaVA model loaded successfully from {model_path}")
 
-        # Move model to GPU if available
+        # Generation continues from the end of each prompt, so batched prompts are padded on the left
+        self.processor.tokenizer.padding_side = "left"
+
+        # device_map="auto" already placed the weights, quantized modules cannot be moved with .to()
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
-        self.logger.info(f"LLaVA model loaded and moved to {self.device}")
+        self.logger.info(f"LLaVA model loaded on {self.device}")
+
+    def _compile_model(self):
+        """
+        Compile the model forward pass with torch.compile and warm it up.
+        """
+        if not torch.cuda.is_available():
+            self.logger.warning("Skipping torch.compile, no GPU available")
+            return
+
+        # Compile forward rather than the module, generate() calls forward on the original module
+        self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", fullgraph=False)
+
+        # A short generation captures the graph now instead of on the first request
+        inputs = self.processor(text="USER: Hello ASSISTANT:", return_tensors="pt").to(device="cuda")
+        with torch.no_grad():
+            self.model.generate(**inputs, max_new_tokens=8, do_sample=False)
+        self.logger.info("LLaVA forward pass compiled")
         
 
     def generate_description(self, img: Image.Image, detected_amenities: Dict[str, List[str]]) -> str:
@@ -92,7 +187,7 @@ class LlavaModel:
             {
                 "role": "user",
                 "content": [
-                    {"type": "image", "image": img},
+                    {"type": "image"},
                     {"type": "text", "text": prompt},
                     ],
             },
@@ -106,12 +201,15 @@ class LlavaModel:
         ]
 
         # Use the model to generate the description
-        
-        inputs = self.processor.apply_chat_template(
+        # Render the template as text and let the processor handle the image and tokenization in one pass
+        text = self.processor.apply_chat_template(
             conversation,
             add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
+            tokenize=False,
+        )
+        inputs = self.processor(
+            text=text,
+            images=img,
             return_tensors="pt",
         ).to(device="cuda", dtype=torch.float16)
         
@@ -119,9 +217,10 @@ class LlavaModel:
             outputs = self.model.generate(
                 **inputs,
                 max_new_tokens=256,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.9
+                do_sample=False,
+                num_beams=1,
+                use_cache=True,
+                pad_token_id=self.processor.tokenizer.eos_token_id
             )
 
         description = self.processor.decode(outputs[0], skip_special_tokens=True)
@@ -143,19 +242,16 @@ class LlavaModel:
         return description
 
 
-    def detect_amenities(self, image: Image.Image, all_amenities: List[str]) -> Dict[str, bool]:
+    def _detect_conversation(self, all_amenities: List[str]) -> List[Dict]:
         """
-        Detect amenities in the image using the model.
+        Build the amenity detection conversation, with a placeholder for the image.
 
         Args:
-            image: The input image for the model.
             all_amenities: List of amenities to detect.
 
         Returns:
-            Dictionary mapping amenity names to boolean values
+            Conversation in the format expected by the processor chat template
         """
-        self.logger.info("Detecting amenities in the image...")
-        
         # Use a specific prompt to detect amenities
         # Create a prompt for the model
         prompt = (
@@ -168,11 +264,11 @@ class LlavaModel:
             f"Example format: {{\"amenity1\": true, \"amenity2\": false, ...}}"
         )
 
-        conversation = [
+        return [
             {
                 "role": "user",
                 "content": [
-                    {"type": "image", "image": image},
+                    {"type": "image"},
                     {"type": "text", "text": prompt},
                     ],
             },
@@ -185,25 +281,121 @@ class LlavaModel:
             },
         ]
 
-        # Process the image and generate text
-        inputs = self.processor.apply_chat_template(
-            conversation,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
+    def _get_detect_prompt(self, all_amenities: List[str]) -> str:
+        """
+        Get the rendered detection prompt for a list of amenities, rendering it only on first use.
+
+        Args:
+            all_amenities: List of amenities to detect.
+
+        Returns:
+            The chat template output for the detection conversation
+        """
+        key = tuple(all_amenities)
+        if key not in self._detect_prompts:
+            self._detect_prompts[key] = self.processor.apply_chat_template(
+                self._detect_conversation(all_amenities),
+                add_generation_prompt=True,
+                tokenize=False,
+            )
+        return self._detect_prompts[key]
+
+    def detect_amenities(self, image: Image.Image, all_amenities: List[str]) -> Dict[str, bool]:
+        """
+        Detect amenities in the image using the model.
+
+        Args:
+            image: The input image for the model.
+            all_amenities: List of amenities to detect.
+
+        Returns:
+            Dictionary mapping amenity names to boolean values
+        """
+        self.logger.info("Detecting amenities in the image...")
+
+        # Process the image and generate text, reusing the prompt if this list was seen before
+        inputs = self.processor(
+            text=self._get_detect_prompt(all_amenities),
+            images=image,
+            return_tensors="pt",
+        ).to(device="cuda", dtype=torch.float16)
+
+        return self._generate_amenities(inputs, len(all_amenities))[0]
+
+    def detect_amenities_batch(self, images: List[Image.Image], all_amenities: List[str]) -> List[Dict[str, bool]]:
+        """
+        Detect amenities in several images with a single generate call.
+
+        Args:
+            images: The input images for the model.
+            all_amenities: List of amenities to detect, shared by all images.
+
+        Returns:
+            List of dictionaries mapping amenity names to boolean values, one per image
+        """
+        self.logger.info(f"Detecting amenities in a batch of {len(images)} images...")
+
+        # Every image gets the same prompt, padded into one batch
+        prompt = self._get_detect_prompt(all_amenities)
+        inputs = self.processor(
+            text=[prompt] * len(images),
+            images=images,
+            padding=True,
             return_tensors="pt",
         ).to(device="cuda", dtype=torch.float16)
 
+        return self._generate_amenities(inputs, len(all_amenities))
+
+    def _generate_amenities(self, inputs, num_amenities: int) -> List[Dict[str, bool]]:
+        """
+        Run generation on processed inputs and parse the amenity JSON from each response.
+
+        Args:
+            inputs: Processor outputs for one or more detection conversations.
+            num_amenities: Number of amenities asked for, used to bound the response length.
+
+        Returns:
+            List of dictionaries mapping amenity names to boolean values, one per input
+        """
         # Because we dont want gradient calculation
+        # A pretty-printed "amenity": bool entry can take a dozen tokens, so the cap is generous;
+        # generation normally stops well before it, as soon as the JSON object is closed
+        max_new_tokens = max(512, 32 + 16 * num_amenities)
+        json_stop = JSONBraceStop(self.processor.tokenizer)
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=512,
-                do_sample=False
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                num_beams=1,
+                use_cache=True,
+                pad_token_id=self.processor.tokenizer.eos_token_id,
+                stopping_criteria=StoppingCriteriaList([json_stop])
             )
-        
-        # Decode the response (could be batch_decode or decode)
-        response = self.processor.decode(outputs[0], skip_special_tokens=True)
+
+        # A response cut off before its closing brace cannot be parsed and yields no amenities
+        for i in range(outputs.shape[0]):
+            if not json_stop.is_closed(i):
+                self.logger.warning(
+                    f"Response {i} ended without closing its JSON object (max_new_tokens={max_new_tokens}), "
+                    f"its amenities may be missing"
+                )
+
+        # Decode the responses
+        responses = self.processor.batch_decode(outputs, skip_special_tokens=True)
+
+        return [self._parse_amenities(response) for response in responses]
+
+    def _parse_amenities(self, response: str) -> Dict[str, bool]:
+        """
+        Extract the amenity JSON from a decoded model response.
+
+        Args:
+            response: Decoded model output, including the prompt.
+
+        Returns:
+            Dictionary mapping amenity names to boolean values, empty if no JSON could be parsed
+        """
         # Log the response in debug mode
         self.logger.debug(f"Model response: {response}")
 
@@ -219,23 +411,21 @@ class LlavaModel:
             json_end = response.rfind('}') + 1
 
             if json_start == -1 or json_end == 0:
-                if self.logger:
-                    self.logger.error(f"Could not find JSON like object in response.")
-                    json_text = {}
-            else:
-                json_text = response[json_start:json_end]
+                self.logger.error(f"Could not find JSON like object in response.")
+                return {}
+
+            json_text = response[json_start:json_end]
                 
             # Clean up potential formatting issues
             json_text = json_text.replace("'", "\"").replace("True", "true").replace("False", "false")
             # Fix escaped backslashes in property names
             json_text = json_text.replace("\\_", "_")
             # Parse the JSON response
-            detected_amenities = json.loads(json_text)
+            detected_amenities = json_loads(json_text)
             
             return detected_amenities
 
         except json.JSONDecodeError as e:
-            if self.logger:
-                self.logger.error(f"Error decoding JSON response: {e}")
-                self.logger.error(f"Response: {response}")
-                return {}
+            self.logger.error(f"Error decoding JSON response: {e}")
+            self.logger.error(f"Response: {response}")
+            return {}
@@ -19,6 +19,7 @@ try:
 except (AttributeError, TypeError):
     pass
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Tuple
 from PIL import Image
 
@@ -73,11 +74,8 @@ class SteramlitConfigWrapper:
         Returns:
             Tuple of (amenities, description, processing_time)
         """
-        # Import here to avoid circular imports
-        from core.amenity_system import PropertyAmenitySystem
-
-        # Initialize the system with configuration
-        system = PropertyAmenitySystem(self.config, logger=self.logger)
+        # The system (and its model weights) is loaded once and reused across reruns
+        system = get_system()
         
         # Generate a temporary filename
         image_name = f"temp_{int(time.time())}.jpg"
@@ -85,14 +83,38 @@ class SteramlitConfigWrapper:
         # Start timing
         start_time = time.time()
         
-        # Process the image
-        amenities_by_room, description, detected_amenities = system.process_image_from_memory(image, image_name)
+        # Process the image on the shared inference executor
+        future = get_executor().submit(system.process_image_from_memory, image, image_name)
+        amenities_by_room, description, detected_amenities = future.result()
 
         # End timing
         processing_time = time.time() - start_time
         
         return amenities_by_room, description, detected_amenities, processing_time
 
+@st.cache_resource
+def get_streamlit_config() -> SteramlitConfigWrapper:
+    """Initialize Hydra and the logger once per Streamlit server process."""
+    return SteramlitConfigWrapper()
+
+@st.cache_resource
+def get_system():
+    """Load the PropertyAmenitySystem once per Streamlit server process."""
+    # Import here to avoid circular imports
+    from core.amenity_system import PropertyAmenitySystem
+
+    streamlitconfig = get_streamlit_config()
+    return PropertyAmenitySystem(streamlitconfig.config, logger=streamlitconfig.logger)
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool that runs image preprocessing and inference for all sessions.
+    Cached because Streamlit re-executes this module on every rerun, and shared so that
+    sessions using the cached system do not all run the model at once.
+    """
+    return ThreadPoolExecutor(max_workers=2)
+
 # Constants
 API_URL = os.environ.get("API_URL", "http://localhost:8000")
 
@@ -104,7 +126,7 @@ def main():
         layout="wide",
     )
 
-    streamlitconfig = SteramlitConfigWrapper()
+    streamlitconfig = get_streamlit_config()
 
     st.title("Property Amenity Detection")
     st.markdown("""
@@ -247,30 +269,40 @@ def process_image_via_api(uploaded_file) -> Tuple[Dict[str, Dict[str, bool]], st
 def view_all_results():
     """View all processed results from the API."""
     try:
-        response = requests.get(f"{API_URL}/api/amenities/results")
-        
-        if response.status_code == 200:
-            results = response.json()["results"]
-            
-            if not results:
-                st.info("No results available")
-                return
-                
-            # Convert to DataFrame for better display
-            df = pd.DataFrame(results)
-            st.dataframe(df)
-            
-            # Download button
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label="Download Results as CSV",
-                data=csv,
-                file_name="amenity_results.csv",
-                mime="text/csv",
+        # /results is paginated, so fetch pages until one comes back short
+        results = []
+        page_size = 1000
+        while True:
+            response = requests.get(
+                f"{API_URL}/api/amenities/results",
+                params={"limit": page_size, "offset": len(results)}
             )
-        else:
-            st.error(f"API Error: {response.status_code} - {response.text}")
-            
+            if response.status_code != 200:
+                st.error(f"API Error: {response.status_code} - {response.text}")
+                return
+
+            page = response.json()["results"]
+            results.extend(page)
+            if len(page) < page_size:
+                break
+
+        if not results:
+            st.info("No results available")
+            return
+
+        # Convert to DataFrame for better display
+        df = pd.DataFrame(results)
+        st.dataframe(df)
+
+        # Download button
+        csv = df.to_csv(index=False)
+        st.download_button(
+            label="Download Results as CSV",
+            data=csv,
+            file_name="amenity_results.csv",
+            mime="text/csv",
+        )
+
     except Exception as e:
         st.error(f"Error: {str(e)}")
 
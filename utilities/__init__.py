@@ -1,10 +1,13 @@
 """Imports for utililty functions."""
 
-from .general_utils import load_json, save_plot
-from .retriever import find_closest_entry
+from .general_utils import json_loads, load_json, get_plot_path, save_plot
+from .retriever import build_index, find_closest_entry
 
 __all__ = [
+    "json_loads",
     "load_json",
+    "get_plot_path",
     "save_plot",
+    "build_index",
     "find_closest_entry",
 ]
\ No newline at end of file
@@ -2,18 +2,37 @@
 import os
 import json
 
+# orjson parses several times faster; its JSONDecodeError subclasses the stdlib one
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 
 # Helper functions to load json file
 def load_json(json_path: str):
     try:
-        with open(json_path, 'r') as f:
-            data = json.load(f)
+        with open(json_path, 'rb') as f:
+            data = json_loads(f.read())
         return data
 
     except json.JSONDecodeError as e:
         print(f"Error decoding JSON: {e}")
         return None
 
+#Helper function to get the path a plot is saved to.
+def get_plot_path(folder_name):
+    """
+    Returns the output path of the plot for a folder/file, creating the plots directory if needed.
+    Args:
+        folder_name (str): The folder name to use in the file name.
+    Returns:
+        str: Path of the PNG file.
+    """
+    output_dir = os.path.join("/home/s.bhat/Coding/amenity_detection/", "plots")
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, f"{folder_name}.png")
+
 #Helper function to save the plot.
 def save_plot(fig, folder_name):
     """
@@ -22,8 +41,7 @@ def save_plot(fig, folder_name):
         fig (matplotlib.figure.Figure): The figure to save.
         folder_name (str): The folder name to use in the file name.
     """
-    output_dir = os.path.join("/home/s.bhat/Coding/amenity_detection/", "plots")
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{folder_name}.png")
-    fig.savefig(output_path)
+    output_path = get_plot_path(folder_name)
+    # Fast zlib level: the default compression costs far more time than the space it saves
+    fig.savefig(output_path, pil_kwargs={"compress_level": 1})
     print(f"Plot saved to {output_path}")
\ No newline at end of file
@@ -1,12 +1,92 @@
 """Python file that contains the retriver function for RAG based pipeline."""
+import os
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
+
+# Memory-mapped indices written by build_index, keyed by path
+_index_cache = {}
+
+
+def _build_matrix(metadata: List[Dict[str, Any]]) -> Tuple[np.ndarray, List[int]]:
+    """
+    Stack and L2-normalize the embeddings of the metadata entries.
+
+    Args:
+        metadata (List[Dict[str, Any]]): List of metadata entries.
+
+    Returns:
+        Tuple[np.ndarray, List[int]]: The (N, D) float32 matrix of normalized embeddings and,
+        for each of its rows, the index of the metadata entry it came from.
+    """
+    indices = [i for i, entry in enumerate(metadata) if 'embedding' in entry]
+    if indices:
+        matrix = np.stack([np.ravel(metadata[i]['embedding']) for i in indices]).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Zero vectors keep a similarity of 0, as with sklearn's cosine_similarity
+        norms[norms == 0] = 1
+        matrix /= norms
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+
+    return matrix, indices
+
+
+def _matrix_path(index_path: str) -> str:
+    """Path np.save writes the matrix to, which always ends in .npy."""
+    return index_path if index_path.endswith(".npy") else f"{index_path}.npy"
+
+
+def _indices_path(index_path: str) -> str:
+    """Path of the row to metadata entry mapping stored next to an index."""
+    return f"{os.path.splitext(_matrix_path(index_path))[0]}_indices.npy"
+
+
+def build_index(metadata: List[Dict[str, Any]], out_path: str) -> str:
+    """
+    Save the normalized embeddings of the metadata entries as an index for find_closest_entry.
+
+    The (N, D) float32 matrix is written to out_path with np.save, and the metadata index of each
+    row to a "_indices.npy" file next to it. Both are memory-mapped when searched.
+
+    Args:
+        metadata (List[Dict[str, Any]]): List of metadata entries.
+        out_path (str): Path of the .npy file to write, the suffix is added if missing.
+
+    Returns:
+        str: Path of the index file written.
+    """
+    matrix, indices = _build_matrix(metadata)
+    out_path = _matrix_path(out_path)
+    np.save(out_path, matrix)
+    np.save(_indices_path(out_path), np.asarray(indices, dtype=np.int64))
+    _index_cache.pop(out_path, None)
+    return out_path
+
+
+def _load_index(index_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Memory-map an index written by build_index, opening it only on first use.
+
+    Args:
+        index_path (str): Path passed to or returned by build_index.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The normalized embedding matrix and the metadata index of each row.
+    """
+    index_path = _matrix_path(index_path)
+    if index_path not in _index_cache:
+        _index_cache[index_path] = (
+            np.load(index_path, mmap_mode='r'),
+            np.load(_indices_path(index_path), mmap_mode='r'),
+        )
+    return _index_cache[index_path]
+
 
 def find_closest_entry(
     query_embedding: np.ndarray,
     metadata: List[Dict[str, Any]],
     top_k: int = 1,
+    index_path: Optional[str] = None,
 ):
     """
     Find the closest entry in the metadata based on cosine similarity.
@@ -15,23 +95,29 @@ def find_closest_entry(
         query_embedding (np.ndarray): The embedding of the query.
         metadata (List[Dict[str, Any]]): List of metadata entries.
         top_k (int): Number of closest entries to return.
+        index_path (Optional[str]): Index written by build_index for this metadata. When given, the
+            embeddings are read from it instead of being stacked from the metadata entries on every call.
 
     Returns:
         List[Dict[str, Any]]: List of closest metadata entries.
     """
-    # Open an empty similar list
-    similar_list = []
+    matrix, indices = _load_index(index_path) if index_path is not None else _build_matrix(metadata)
+    if len(indices) == 0 or top_k <= 0:
+        return []
+
+    # Normalize the query so a single matrix-vector product gives all cosine similarities
+    query = np.ravel(query_embedding).astype(np.float32)
+    norm = np.linalg.norm(query)
+    if norm > 0:
+        query = query / norm
+    similarities = matrix @ query
 
-    for entry in metadata:
-        if 'embedding' not in entry:
-            continue
-        # Calculate the cosine similarity
-        similarity = cosine_similarity(query_embedding.reshape(1, -1), entry['embedding'].reshape(1, -1))[0][0]
-        # Append the similarity and entry to the list
-        similar_list.append((similarity, entry))
-    
-    # Once we have a list, sort it by similarity
-    similar_list.sort(reverse=True, key=lambda x: x[0])
+    # Select the top k without sorting every similarity, then order just those
+    if top_k < len(similarities):
+        top = np.argpartition(-similarities, top_k)[:top_k]
+    else:
+        top = np.arange(len(similarities))
+    top = top[np.argsort(-similarities[top], kind="stable")]
 
     # Return the top k entries
-    return [entry for _, entry in similar_list[:top_k]]
+    return [metadata[indices[i]] for i in top]